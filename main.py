@@ -1,147 +1,407 @@
 import akshare as ak
 import pandas as pd
+import numpy as np
 import os
+import re
 import json
+import math
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
+import random
 import glob
+import hashlib
+import functools
+import shutil
+import threading
+import string
+import heapq
+from pathlib import Path
+from html import escape as html_escape
+from operator import attrgetter
 from datetime import datetime, timedelta
 from collections import Counter
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# orjson 可选：装了就用 (快且直接输出 UTF-8 bytes)，没装退回标准库
+# default=str：日期等非 JSON 类型混进来时按字符串写出，不让整次保存失败
+try:
+    import orjson
+    def json_loads(data): return orjson.loads(data)
+    def json_dumps(obj): return orjson.dumps(obj, default=str)
+except ImportError:
+    def json_loads(data): return json.loads(data)
+    def json_dumps(obj): return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
 
 # --- 1. 配置项 ---
+def env_number(name, default, cast=int):
+    # 变量为空 (Actions 里未设置的 vars.X 会传空串)、写错或是 nan/inf 时退回默认值，不在导入时崩掉
+    try:
+        value = cast(os.environ.get(name) or default)
+        if math.isfinite(value): return value
+    except ValueError: pass
+    print(f"⚠️ 环境变量 {name} 无效，使用默认值 {default}")
+    return default
+
 TG_BOT_TOKEN = os.environ.get("TG_BOT_TOKEN")
-TG_CHAT_IDS = os.environ.get("TG_CHAT_IDS", "").split(",")
+TG_CHAT_IDS = [c.strip() for c in os.environ.get("TG_CHAT_IDS", "").split(",") if c.strip()]
 PAGE_URL_PREFIX = os.environ.get("PAGE_URL_PREFIX", "")
 
 HISTORY_FILE = 'concept_history.json'
 ARCHIVE_DIR = 'archive'
 HTML_FILE = 'index.html'
+# 板块历史只保留最近 N 天，避免文件无限增长
+HISTORY_KEEP_DAYS = 30
+# 判断"新风口"时回看的天数 (这几天出现过的板块不算新)
+NEW_CONCEPT_LOOKBACK_DAYS = 5
+# 筛选用到的K线列，顺序对应 screen_batch 里的下标
+KLINE_FIELDS = ['收盘', '开盘', '涨跌幅', '成交量']
+# 少于这么多根K线视为数据缺失 (新股等)
+KLINE_MIN_ROWS = 5
+# K线请求回看的自然日数 (春节等长假也能凑够 KLINE_MIN_ROWS 根)
+KLINE_LOOKBACK_DAYS = 30
+# 接口结果本地缓存 (K线/板块成分股/板块排行)；CI 上每次都是新机器，靠 workflow 的 actions/cache 按日期恢复该目录
+CACHE_DIR = 'cache'
+CACHE_KEEP_DAYS = 3
+CACHE_MAX_MB = 200
+# 缓存复用规则 (K线/成分股/板块排行 都带今天的实时行情，统一一条)：
+# 盘中拉到的只在 N 分钟内复用 (如失败重跑)；收盘后 (本地时间，CI 上 TZ=Asia/Shanghai) 拉到的当天不会再变，一直复用
+LIVE_CACHE_MINUTES = 15
+MARKET_CLOSE_HOUR = 15
+# 缓存命中统计 (多线程累加，需加锁)
+CACHE_STATS = Counter()
+_CACHE_STATS_LOCK = threading.Lock()
+# 板块名称过滤规则 (模块加载时编译一次)
+_CONCEPT_EXCLUDE_RE = re.compile(r'涨停|连板')
+# 深度扫描并发线程数 (akshare 有频率限制，默认 8，可用环境变量调整，上限 16)
+MAX_WORKERS = max(1, min(env_number("SCAN_WORKERS", 8), 16))
+# 板块成分股接口更容易被限流，单独压低并发
+CONCEPT_WORKERS = 4
+# akshare 接口调用速率上限 (令牌桶，每秒最多发起 N 次调用，可短时突发 N 次；设为 0 关闭)
+# 按 call_with_retry 的调用计数，不是 HTTP 请求数：分页接口 (如板块成分股) 内部的多次请求只占一个令牌
+AK_CALLS_PER_SEC = env_number("AK_CALLS_PER_SEC", 10.0, float)
+
+# 全局共用一个带连接池的 Session (Telegram + akshare)，复用 keep-alive 连接，省掉每次请求的 TCP+TLS 握手
+REQUEST_TIMEOUT = 15
+
+class TimeoutSession(requests.Session):
+    # timeout 没传或传了 None 都补上默认值 (akshare 多数接口默认就是显式传 timeout=None)，调用方给了具体值就用调用方的
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None: kwargs['timeout'] = REQUEST_TIMEOUT
+        return super().request(method, url, **kwargs)
+
+SESSION = TimeoutSession()
+# 默认带浏览器 UA，只设置一次；akshare 自带 headers 的请求会按请求级覆盖
+SESSION.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'})
+# 连接失败/读超时/限流/5xx 由 urllib3 在连接层重试 (遵守 Retry-After)；最终失败的响应原样交给调用方处理
+_RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=_RETRY)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
 
 # --- 2. 基础工具 ---
 def send_telegram_message(message):
-    if not TG_BOT_TOKEN or not TG_CHAT_IDS: 
-        print("❌ 未检测到 TG 配置")
-        return
+    # 调用方 (run_task) 已确认 TG 已配置
     url = f"https://api.telegram.org/bot{TG_BOT_TOKEN}/sendMessage"
-    for chat_id in TG_CHAT_IDS:
-        chat_id = chat_id.strip()
-        if not chat_id: continue
-        try:
-            if len(message) > 4000: message = message[:4000] + "\n...(截断)"
-            payload = {'chat_id': chat_id, 'text': message, 'parse_mode': 'Markdown', 'disable_web_page_preview': True}
-            requests.post(url, json=payload)
-        except Exception as e:
-            print(f"❌ 推送失败: {e}")
+    if len(message) > 4000: message = message[:4000] + "\n...(截断)"
+
+    def post_one(chat_id, max_retries=3):
+        payload = {'chat_id': chat_id, 'text': message, 'parse_mode': 'Markdown', 'disable_web_page_preview': True}
+        for i in range(max_retries):
+            try:
+                resp = SESSION.post(url, json=payload, timeout=10)
+                if resp.ok: return
+                # 只有限流和服务端错误值得重试，其余 (如 Markdown 解析失败) 直接放弃
+                print(f"❌ 推送失败({chat_id}): HTTP {resp.status_code}")
+                if resp.status_code != 429 and resp.status_code < 500: return
+            except Exception as e:
+                print(f"❌ 推送失败: {e}")
+            if i < max_retries - 1: time.sleep(2 ** i)
+
+    # 多个会话并发推送，总耗时约等于一次往返
+    with ThreadPoolExecutor(max_workers=len(TG_CHAT_IDS)) as ex:
+        list(ex.map(post_one, TG_CHAT_IDS))
+
+def use_shared_session():
+    # akshare 内部直接调 requests.get/post，每次新建连接且多数不带超时；统一转到共享 Session (默认超时由 TimeoutSession 补)
+    requests.get = SESSION.get
+    requests.post = SESSION.post
 
-def call_with_retry(func, max_retries=3, delay=1, *args, **kwargs):
+class RateLimiter:
+    # 线程安全的令牌桶：有余量时直接放行，只有接近上限才等待 (每次 acquire 计一次调用)
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.last = burst, time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+RATE_LIMITER = RateLimiter(AK_CALLS_PER_SEC, burst=max(1, int(AK_CALLS_PER_SEC)))
+
+def is_retryable(e):
+    # 只有网络抖动、超时、限流(429)和服务端错误(5xx)值得重试
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)): return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+def call_with_retry(func, max_retries=2, delay=1, *args, **kwargs):
+    # 传输层重试已交给 Session 的 Retry，这里只兜底 akshare 自建连接等漏网的情况
     for i in range(max_retries):
+        RATE_LIMITER.acquire()
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            if i == max_retries - 1: return None
-            time.sleep(delay)
+            if i == max_retries - 1 or not is_retryable(e):
+                # 接口报错统一在这里记一笔再返回 None，调用方只需判空
+                print(f"⚠️ {getattr(func, '__name__', func)} 失败: {type(e).__name__}: {e}")
+                return None
+            # 随机抖动等待，并发线程不会踩着同一节拍重试
+            time.sleep(random.uniform(delay, delay * 3))
     return None
 
+def atomic_write(path, data):
+    # 先写临时文件再 os.replace，进程中途被杀也不会留下半截文件
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f: f.write(data)
+    os.replace(tmp, path)
+
+def cache_is_fresh(mtime):
+    # 规则见配置项 LIVE_CACHE_MINUTES / MARKET_CLOSE_HOUR
+    if time.localtime(mtime).tm_hour >= MARKET_CLOSE_HOUR: return True
+    return time.time() - mtime < LIVE_CACHE_MINUTES * 60
+
+def disk_cache(func):
+    # 结果按 (函数名, 参数) 存盘，按 cache_is_fresh 的规则复用，不再请求接口
+    # 日期不在这里读时钟：被缓存的函数都带一个由本次运行 ctx 算好的日期参数，换日自然换 key
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = hashlib.md5(f"{func.__name__}:{args}:{sorted(kwargs.items())}".encode('utf-8')).hexdigest()
+        path = f"{CACHE_DIR}/{key}.pkl"
+        try:
+            if cache_is_fresh(os.path.getmtime(path)):
+                df = pd.read_pickle(path)
+                with _CACHE_STATS_LOCK: CACHE_STATS[(func.__name__, 'hit')] += 1
+                return df
+        except Exception: pass
+        with _CACHE_STATS_LOCK: CACHE_STATS[(func.__name__, 'miss')] += 1
+        df = func(*args, **kwargs)
+        if df is not None and not df.empty:
+            try: df.to_pickle(path)
+            except Exception: pass
+        return df
+    return wrapper
+
+@disk_cache
+def get_hist(symbol, start_date, end_date):
+    # 只请求最近一个月 (区间由调用方按 ctx 算好)：足够覆盖长假后的5根K线，不必下载上市以来全部日线
+    df = call_with_retry(ak.stock_zh_a_hist, symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
+    if df is None or df.empty: return df
+    # 筛选只看最近几天的这几列；缓存里只存这一小块
+    return df.tail(KLINE_MIN_ROWS)[['日期'] + KLINE_FIELDS].reset_index(drop=True)
+
+@disk_cache
+def get_concept_cons(concept_name, today_str):
+    # today_str 只参与缓存 key
+    return call_with_retry(ak.stock_board_concept_cons_em, symbol=concept_name)
+
+def prune_cache():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    expire = time.time() - CACHE_KEEP_DAYS * 86400
+    entries = []
+    for f_path in glob.glob(f"{CACHE_DIR}/*.pkl"):
+        try:
+            st = os.stat(f_path)
+            if st.st_mtime < expire: os.remove(f_path)
+            else: entries.append((st.st_mtime, st.st_size, f_path))
+        except OSError: pass
+    # 超过容量上限时从最旧的开始删
+    total = sum(size for _, size, _ in entries)
+    for _, size, f_path in sorted(entries):
+        if total <= CACHE_MAX_MB * 1024 * 1024: break
+        try: os.remove(f_path)
+        except OSError: pass
+        total -= size
+
+# 失败结果 (None) disk_cache 不会落盘
+@disk_cache
+def get_concept_boards(today_str):
+    # today_str 只参与缓存 key
+    return call_with_retry(ak.stock_board_concept_name_em)
+
+@functools.lru_cache(maxsize=1)
+def _read_history():
+    # 进程内只读一次盘；写盘后 cache_clear。调用方不要直接改这个 dict
+    try:
+        return json_loads(Path(HISTORY_FILE).read_bytes())
+    except FileNotFoundError: return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 历史文件读取失败，按空记录处理: {e}")
+        return {}
+
+def load_history(now):
+    keep_cutoff = (now - timedelta(days=HISTORY_KEEP_DAYS)).strftime('%Y-%m-%d')
+    return {d: v for d, v in _read_history().items() if d >= keep_cutoff}
+
+def save_history(history_data):
+    atomic_write(HISTORY_FILE, json_dumps(history_data))
+    _read_history.cache_clear()
+
 # --- 3. 选股逻辑 (已修复接口) ---
-def check_stock_criteria(symbol, name, price, concept_name):
+class Pick(NamedTuple):
+    name: str
+    symbol: str
+    concept: str
+    cum_rise: float
+    price: float
+    vol_ratio: float
+
+PASS_REASON = "✅ 晋级"
+
+def screen_batch(klines):
+    # 纯计算内核：klines 形状 (N, 4, 4)，即 N 只股票 x 最近4日 x KLINE_FIELDS
+    # 一次广播算完所有股票的三道关卡，返回 (淘汰码, 3日涨幅, 量比)，不做任何 I/O
+    close, open_, pct, vol = (klines[:, :, k] for k in range(4))
+    # --- 关卡 1: 形态 (3连阳) ---
+    is_uptrend = (close[:, -3:] >= open_[:, -3:]).all(axis=1)
+    # --- 关卡 2: 涨幅 (拒绝暴涨) ---
+    cum_rise = pct[:, -3:].sum(axis=1)
+    # --- 关卡 3: 量能 (温和放量) ---
+    vol_today, vol_yest = vol[:, -1], vol[:, -2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ratio = np.where(vol_yest > 0, vol_today / vol_yest, np.nan)
+    # 按关卡顺序取第一个不满足的 (0 = 全部通关)
+    codes = np.select([~is_uptrend, cum_rise >= 20, cum_rise <= 0, vol_yest == 0, vol_ratio <= 1.0, vol_ratio > 3.0],
+                      [1, 2, 3, 4, 5, 6], default=0)
+    return codes, cum_rise, vol_ratio
+
+def format_reason(code, cum_rise, vol_ratio):
+    if code == 1: return "❌ 形态(非3连阳)"
+    if code == 2: return f"❌ 涨幅(过大{cum_rise:.1f}%)"
+    if code == 3: return "❌ 涨幅(累积下跌)"
+    if code == 4: return "❌ 停牌"
+    if code == 5: return f"❌ 量能(缩量{vol_ratio:.1f})"
+    if code == 6: return f"❌ 量能(爆量{vol_ratio:.1f})"
+    return PASS_REASON
+
+def load_recent_kline(symbol, start_date, end_date):
     try:
-        # 1. 获取K线 (修复点：使用新接口 stock_zh_a_hist)
-        # 注意：start_date 不填默认就是最近的数据，我们只需要最近几天，所以不用管日期
-        df_hist = call_with_retry(ak.stock_zh_a_hist, symbol=symbol, period="daily", adjust="qfq")
-        
-        if df_hist is None or len(df_hist) < 5: return None, "数据缺失"
+        # 获取K线 (修复点：使用新接口 stock_zh_a_hist)
+        df_hist = get_hist(symbol, start_date, end_date)
         
-        recent = df_hist.tail(4)
-        today = recent.iloc[-1]
-        yesterday = recent.iloc[-2]
-        
-        # --- 关卡 1: 形态 (3连阳) ---
-        last_3_days = recent.iloc[-3:]
-        is_uptrend = all(row['收盘'] >= row['开盘'] for _, row in last_3_days.iterrows())
-        if not is_uptrend: return None, "❌ 形态(非3连阳)"
-
-        # --- 关卡 2: 涨幅 (拒绝暴涨) ---
-        cum_rise = last_3_days['涨跌幅'].sum()
-        if cum_rise >= 20: return None, f"❌ 涨幅(过大{cum_rise:.1f}%)"
-        if cum_rise <= 0: return None, "❌ 涨幅(累积下跌)"
-
-        # --- 关卡 3: 量能 (温和放量) ---
-        vol_today = today['成交量']
-        vol_yest = yesterday['成交量']
-        if vol_yest == 0: return None, "❌ 停牌"
-        
-        vol_ratio = vol_today / vol_yest
-        
-        if vol_ratio <= 1.0: return None, f"❌ 量能(缩量{vol_ratio:.1f})"
-        if vol_ratio > 3.0: return None, f"❌ 量能(爆量{vol_ratio:.1f})"
-
-        # 全部通关
-        return {
-            "name": name,
-            "symbol": symbol,
-            "concept": concept_name,
-            "cum_rise": round(cum_rise, 2),
-            "price": price,
-            "vol_ratio": round(vol_ratio, 2)
-        }, "✅ 晋级"
-    except Exception as e:
+        if df_hist is None or len(df_hist) < KLINE_MIN_ROWS: return None, "数据缺失"
+        # 只取最近4日的底层数组，避免 iterrows / iloc 逐行构造 Series
+        block = df_hist.tail(4)[KLINE_FIELDS].to_numpy(dtype=float)
+        # 有空值 (停牌/接口缺字段) 时比较全是 False，会被当成通关，必须先挡掉
+        if not np.isfinite(block).all(): return None, "数据缺失"
+        return block, None
+    except (KeyError, IndexError, ValueError, TypeError) as e:
         # 打印简短错误信息，方便调试
         return None, f"⚠️ 异常({str(e)})"
 
-def get_hot_stocks_pool(top_concepts, new_concepts):
+def get_hot_stocks_pool(ctx, top_concepts, new_concepts):
     print(f"🎯 正在提取成分股...")
-    sorted_concepts = sorted(top_concepts, key=lambda x: x[0] in new_concepts, reverse=True)
+    new_set = set(new_concepts)
+    sorted_concepts = sorted(top_concepts, key=lambda x: x[0] in new_set, reverse=True)
     
-    all_dfs = []
-    for concept_name, _ in sorted_concepts:
-        try:
-            df = call_with_retry(ak.stock_board_concept_cons_em, symbol=concept_name)
-            if df is not None and not df.empty:
-                df['所属板块'] = concept_name
-                all_dfs.append(df)
-            time.sleep(0.3)
-        except: continue
+    def fetch_cons(concept_name):
+        # call_with_retry 已兜住接口异常并打日志，这里不用再 try
+        df = get_concept_cons(concept_name, ctx.today_str)
+        if df is None or df.empty: return None
+        df['所属板块'] = concept_name
+        return df
+
+    # 并发拉取，map 保持原顺序 (新风口优先，去重时保留)
+    with ThreadPoolExecutor(max_workers=CONCEPT_WORKERS) as ex:
+        all_dfs = [df for df in ex.map(fetch_cons, [n for n, _ in sorted_concepts]) if df is not None]
             
     if not all_dfs: return []
-    pool = pd.concat(all_dfs)
-    pool = pool.drop_duplicates(subset=['代码'], keep='first')
-    # 过滤掉涨跌幅异常的（涨停、跌停、ST）
-    pool = pool[(pool['涨跌幅'] > 0) & (pool['涨跌幅'] < 9.8) & (~pool['名称'].str.contains('ST|退'))]
+    pool = pd.concat(all_dfs, ignore_index=True)
+    # 去重 + 过滤涨跌幅异常的（涨停、跌停、ST）合成一个掩码，只复制一次
+    # ST/退 是固定子串，按字面匹配比走正则快
+    name = pool['名称']
+    mask = (~pool.duplicated(subset=['代码'], keep='first')
+            & pool['涨跌幅'].between(0, 9.8, inclusive='neither')
+            & ~name.str.contains('ST', regex=False, na=False)
+            & ~name.str.contains('退', regex=False, na=False))
+    pool = pool.loc[mask]
     
     print(f"✅ 锁定 {len(pool)} 只潜力股")
     return pool
 
-def run_strict_selection(top_concepts, new_concepts):
+def run_strict_selection(ctx, top_concepts, new_concepts):
     selected_stocks = []
     rejection_stats = Counter()
     
-    candidates = get_hot_stocks_pool(top_concepts, new_concepts)
+    candidates = get_hot_stocks_pool(ctx, top_concepts, new_concepts)
     
     if len(candidates) == 0:
         print("❌ 热点股池为空")
         return []
 
-    check_list = candidates.head(100)
-    total = len(check_list)
+    # 成分股行情里已有今日开盘/现价，今天收阴的必然不是3连阳，不必再请求K线
+    # 先筛再截取前100，扫描名额只留给还有机会的股票
+    pre_rejected = 0
+    if '今开' in candidates.columns:
+        is_yang = candidates['最新价'] >= candidates['今开']
+        pre_rejected = int((~is_yang).sum())
+        candidates = candidates[is_yang]
+        rejection_stats["❌ 形态(非3连阳)"] += pre_rejected
+
+    # 只保留用到的4列再转英文列名：itertuples 每行只拼4个字段 (成分股表原有十几列)，且可以按属性取值
+    scan_list = (candidates.head(100)[['代码', '名称', '最新价', '所属板块']]
+                 .rename(columns={'代码': 'code', '名称': 'name', '最新价': 'price', '所属板块': 'concept'}))
+    total = pre_rejected + len(scan_list)
     
     print("\n" + "="*50)
     print(f"🔍 开始深度扫描 (目标: {total} 只)")
     print("="*50)
+    if pre_rejected: print(f"⚡ 行情预筛淘汰 {pre_rejected} 只 (今日收阴)")
     
-    for i, (_, row) in enumerate(check_list.iterrows()):
-        try:
-            res, reason = check_stock_criteria(row['代码'], row['名称'], row['最新价'], row['所属板块'])
+    # 1. 并发下载K线 (请求区间按本次运行的日期算一次，同时也是缓存 key 的一部分)
+    end_date = ctx.now.strftime('%Y%m%d')
+    start_date = (ctx.now - timedelta(days=KLINE_LOOKBACK_DAYS)).strftime('%Y%m%d')
+    rows, blocks = [], []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {ex.submit(load_recent_kline, row.code, start_date, end_date): row for row in scan_list.itertuples(index=False)}
+        for fut in as_completed(futures):
+            row = futures[fut]
+            # 单只股票出了意料外的错也只算它自己淘汰，不让整次扫描中断
+            try: block, reason = fut.result()
+            except Exception as e: block, reason = None, f"⚠️ 异常({type(e).__name__}: {e})"
+            if block is None:
+                rejection_stats[reason] += 1
+                print(f"{row.name}\t -> {reason}")
+                continue
+            rows.append(row)
+            blocks.append(block)
+
+    # 2. 所有股票叠成一个数组，一次算完
+    if blocks:
+        codes, cum_rises, vol_ratios = screen_batch(np.stack(blocks))
+        for row, code, cum_rise, vol_ratio in zip(rows, codes, cum_rises, vol_ratios):
+            reason = format_reason(code, cum_rise, vol_ratio)
             rejection_stats[reason] += 1
             
-            status_icon = "✨" if res else "  "
+            status_icon = "✨" if code == 0 else "  "
             # 缩短日志长度，避免刷屏太快
-            print(f"[{i+1}/{total}] {row['名称']}\t -> {reason} {status_icon}")
+            print(f"{row.name}\t -> {reason} {status_icon}")
             
-            if res:
-                selected_stocks.append(res)
-            
-            time.sleep(0.1)
-        except: continue
+            if code == 0:
+                selected_stocks.append(Pick(row.name, row.code, row.concept, round(float(cum_rise), 2), row.price, round(float(vol_ratio), 2)))
 
     print("\n" + "="*50)
     print("📊 淘汰原因统计")
@@ -153,148 +413,185 @@ def run_strict_selection(top_concepts, new_concepts):
         bar = "█" * bar_len
         print(f"{reason:<15} : {count:>3} {bar}")
     print("="*50 + "\n")
-            
+    
+    # 按量比排好一次，网页和推送共用
+    selected_stocks.sort(key=attrgetter('vol_ratio'), reverse=True)
     return selected_stocks
 
 # --- 4. 网页生成 ---
-def generate_html_report(today_str, new_concepts, top_concepts, picks):
-    stock_rows = ""
-    if picks:
-        picks_sorted = sorted(picks, key=lambda x: x['vol_ratio'], reverse=True)
-        for s in picks_sorted:
-            is_new = s['concept'] in new_concepts
-            concept_class = "red-text" if is_new else "gray-text"
-            concept_icon = "🔥" if is_new else ""
-            stock_rows += f"""
+# 模板在模块加载时解析一次，每次只替换动态片段
+_ROW_TEMPLATE = string.Template("""
             <tr>
-                <td><div class="stock-name">{s['name']}</div><div class="stock-code">{s['symbol']}</div></td>
-                <td><span class="{concept_class}">{concept_icon}{s['concept']}</span></td>
-                <td class="red-text">+{s['cum_rise']}%</td>
-                <td>{s['vol_ratio']}</td>
-            </tr>"""
-    else:
-        stock_rows = "<tr><td colspan='4' style='text-align:center;color:#999;padding:30px'>今日无个股符合条件<br><small>请查看日志获取淘汰详情</small></td></tr>"
+                <td><div class="stock-name">${name}</div><div class="stock-code">${symbol}</div></td>
+                <td><span class="${concept_class}">${concept_icon}${concept}</span></td>
+                <td class="red-text">+${cum_rise}%</td>
+                <td>${vol_ratio}</td>
+            </tr>""")
 
-    concept_html = "".join([f'<span class="tag">{n}</span>' for n in new_concepts]) if new_concepts else '<span style="color:#999;font-size:12px">无新面孔</span>'
-    top_html = "".join([f'<span class="tag tag-gray">{n}</span>' for n, _ in top_concepts])
-
-    history_links_html = ""
-    if os.path.exists(ARCHIVE_DIR):
-        files = sorted(glob.glob(f"{ARCHIVE_DIR}/*.html"), reverse=True)[:7]
-        if files:
-            history_links_html = "<h3>📅 历史回顾</h3><div class='history-list'>"
-            for f_path in files:
-                fname = os.path.basename(f_path) 
-                date_label = fname.replace(".html", "")
-                history_links_html += f"<a href='{ARCHIVE_DIR}/{fname}' class='history-link'>{date_label}</a>"
-            history_links_html += "</div>"
-
-    html = f"""
+_HTML_TEMPLATE = string.Template("""
     <!DOCTYPE html>
     <html lang="zh">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>A股复盘 {today_str}</title>
+        <title>A股复盘 ${today_str}</title>
         <style>
-            body {{ font-family: -apple-system, sans-serif; background: #f0f2f5; padding: 15px; margin: 0; }}
-            .container {{ max_width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 12px; }}
-            h1 {{ font-size: 20px; text-align: center; color: #333; }}
-            h2 {{ font-size: 16px; border-left: 4px solid #e74c3c; padding-left: 10px; margin-top: 25px; }}
-            .tag {{ display: inline-block; background: #ffe2e2; color: #e74c3c; padding: 4px 8px; border-radius: 4px; font-size: 12px; margin: 0 5px 5px 0; }}
-            .tag-gray {{ background: #f4f4f5; color: #909399; }}
-            table {{ width: 100%; border-collapse: collapse; margin-top: 10px; font-size: 14px; }}
-            th {{ text-align: left; color: #909399; font-weight: normal; border-bottom: 1px solid #eee; padding-bottom: 5px; }}
-            td {{ padding: 10px 0; border-bottom: 1px solid #f5f5f5; vertical-align: middle; }}
-            .red-text {{ color: #e74c3c; font-weight: bold; }}
-            .gray-text {{ color: #666; }}
-            .stock-name {{ font-weight: bold; font-size: 15px; }}
-            .stock-code {{ font-size: 12px; color: #999; }}
-            .history-list {{ display: flex; gap: 8px; flex-wrap: wrap; }}
-            .history-link {{ text-decoration: none; font-size: 12px; color: #666; background: #eee; padding: 4px 8px; border-radius: 4px; }}
-            .footer {{ text-align: center; margin-top: 30px; font-size: 12px; color: #ccc; }}
+            body { font-family: -apple-system, sans-serif; background: #f0f2f5; padding: 15px; margin: 0; }
+            .container { max_width: 600px; margin: 0 auto; background: white; padding: 20px; border-radius: 12px; }
+            h1 { font-size: 20px; text-align: center; color: #333; }
+            h2 { font-size: 16px; border-left: 4px solid #e74c3c; padding-left: 10px; margin-top: 25px; }
+            .tag { display: inline-block; background: #ffe2e2; color: #e74c3c; padding: 4px 8px; border-radius: 4px; font-size: 12px; margin: 0 5px 5px 0; }
+            .tag-gray { background: #f4f4f5; color: #909399; }
+            table { width: 100%; border-collapse: collapse; margin-top: 10px; font-size: 14px; }
+            th { text-align: left; color: #909399; font-weight: normal; border-bottom: 1px solid #eee; padding-bottom: 5px; }
+            td { padding: 10px 0; border-bottom: 1px solid #f5f5f5; vertical-align: middle; }
+            .red-text { color: #e74c3c; font-weight: bold; }
+            .gray-text { color: #666; }
+            .stock-name { font-weight: bold; font-size: 15px; }
+            .stock-code { font-size: 12px; color: #999; }
+            .history-list { display: flex; gap: 8px; flex-wrap: wrap; }
+            .history-link { text-decoration: none; font-size: 12px; color: #666; background: #eee; padding: 4px 8px; border-radius: 4px; }
+            .footer { text-align: center; margin-top: 30px; font-size: 12px; color: #ccc; }
         </style>
     </head>
     <body>
         <div class="container">
-            <h1>📅 A股复盘日报 <small>{today_str}</small></h1>
+            <h1>📅 A股复盘日报 <small>${today_str}</small></h1>
             <h2>🔥 新风口</h2>
-            <div>{concept_html}</div>
+            <div>${concept_html}</div>
             <h2>📊 领涨板块</h2>
-            <div>{top_html}</div>
+            <div>${top_html}</div>
             <h2>💎 热点严选</h2>
             <p style="font-size:12px;color:#999">条件: Top板块 | 3连阳<20% | 温和放量(1-3倍)</p>
             <table>
                 <thead><tr><th width="30%">股票</th><th width="35%">概念板块</th><th width="20%">3日涨幅</th><th width="15%">量比</th></tr></thead>
-                <tbody>{stock_rows}</tbody>
+                <tbody>${stock_rows}</tbody>
             </table>
-            {history_links_html}
+            ${history_links_html}
             <div class="footer">Data by AkShare | Designed by Kevin Xing</div>
         </div>
     </body>
     </html>
-    """
-    return html
+    """)
 
-# --- 5. 主程序 ---
-def run_task():
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    print(f"🚀 启动: {today_str}")
+def list_recent_archives(n=7):
+    if not os.path.isdir(ARCHIVE_DIR): return []
+    # 只要最新 n 个，堆取 Top-K 即可，不必整体排序
+    with os.scandir(ARCHIVE_DIR) as it:
+        return heapq.nlargest(n, (e.name for e in it if e.name.endswith('.html')))
 
-    top_concepts = []
-    try:
-        df = call_with_retry(ak.stock_board_concept_name_em)
-        if df is not None:
-            df = df.sort_values('涨跌幅', ascending=False)
-            df = df[~df['板块名称'].str.contains('涨停|连板')]
-            top_concepts = list(zip(df.head(10)['板块名称'], df.head(10)['涨跌幅']))
-    except: pass
+def generate_html_report(ctx, new_concepts, top_concepts, picks, history_files):
+    if picks:
+        # 列表保留展示顺序，集合只用于 O(1) 判断
+        new_set = set(new_concepts)
+        rows = []
+        for s in picks:
+            is_new = s.concept in new_set
+            concept_class = "red-text" if is_new else "gray-text"
+            concept_icon = "🔥" if is_new else ""
+            # 名称/板块来自接口，转义后再拼进页面
+            rows.append(_ROW_TEMPLATE.substitute(name=html_escape(s.name), symbol=s.symbol, concept=html_escape(s.concept), cum_rise=s.cum_rise,
+                                                 vol_ratio=s.vol_ratio, concept_class=concept_class, concept_icon=concept_icon))
+        stock_rows = "".join(rows)
+    else:
+        stock_rows = "<tr><td colspan='4' style='text-align:center;color:#999;padding:30px'>今日无个股符合条件<br><small>请查看日志获取淘汰详情</small></td></tr>"
 
-    history_data = {}
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                history_data = json.load(f)
-        except: pass
-    
-    past_set = set()
-    cutoff = (datetime.now() - timedelta(days=5)).strftime('%Y-%m-%d')
-    for d, names in history_data.items():
-        if d > cutoff and d != today_str: past_set.update(names)
-    
-    new_concepts = [n for n, r in top_concepts if n not in past_set]
+    concept_html = "".join([f'<span class="tag">{html_escape(n)}</span>' for n in new_concepts]) if new_concepts else '<span style="color:#999;font-size:12px">无新面孔</span>'
+    top_html = "".join([f'<span class="tag tag-gray">{html_escape(n)}</span>' for n, _ in top_concepts])
 
-    picks = run_strict_selection(top_concepts, new_concepts)
+    history_links_html = ""
+    if history_files:
+        links = "".join([f"<a href='{ARCHIVE_DIR}/{fname}' class='history-link'>{fname.replace('.html', '')}</a>" for fname in history_files])
+        history_links_html = f"<h3>📅 历史回顾</h3><div class='history-list'>{links}</div>"
 
-    if not os.path.exists(ARCHIVE_DIR): os.makedirs(ARCHIVE_DIR)
-    html = generate_html_report(today_str, new_concepts, top_concepts, picks)
-    with open(f"{ARCHIVE_DIR}/{today_str}.html", 'w', encoding='utf-8') as f: f.write(html)
-    with open(HTML_FILE, 'w', encoding='utf-8') as f: f.write(html)
+    return _HTML_TEMPLATE.substitute(today_str=ctx.today_str, concept_html=concept_html, top_html=top_html,
+                                      stock_rows=stock_rows, history_links_html=history_links_html)
 
-    # 发送 Telegram
-    msg = [f"📊 *A股复盘* ({today_str})"]
+def build_telegram_message(ctx, new_concepts, picks):
+    msg = [f"📊 *A股复盘* ({ctx.today_str})"]
     if new_concepts: msg.append(f"🔥 *新风口*: {', '.join(new_concepts)}")
     
     if picks:
-        picks_sorted = sorted(picks, key=lambda x: x['vol_ratio'], reverse=True)
-        top_picks = picks_sorted[:10]
+        new_set = set(new_concepts)
+        top_picks = picks[:10]
         msg.append(f"\n💎 *热点严选 Top {len(top_picks)}*")
         for s in top_picks:
-            is_new = s['concept'] in new_concepts
-            concept_str = f"🔥*{s['concept']}*" if is_new else f"({s['concept']})"
-            msg.append(f"• {s['name']} {concept_str}")
-            msg.append(f"   量比:{s['vol_ratio']} | 涨幅:+{s['cum_rise']}%")
+            is_new = s.concept in new_set
+            concept_str = f"🔥*{s.concept}*" if is_new else f"({s.concept})"
+            msg.append(f"• {s.name} {concept_str}")
+            msg.append(f"   量比:{s.vol_ratio} | 涨幅:+{s.cum_rise}%")
         if len(picks) > 10: msg.append(f"...更多见网页")
     else:
         msg.append("\n🍵 今日无严选个股")
 
     if PAGE_URL_PREFIX: msg.append(f"\n🔗 [点击查看网页报表]({PAGE_URL_PREFIX})")
     
-    send_telegram_message("\n".join(msg))
+    return "\n".join(msg)
+
+# --- 5. 主程序 ---
+class RunCtx(NamedTuple):
+    # 本次运行的时间快照：开头算一次往下传，避免跨零点时日期前后不一致
+    now: datetime
+    today_str: str
+    cutoff: str  # 新风口回看起点
+    started_at: float
+
+def new_run_ctx():
+    now = datetime.now()
+    cutoff = (now - timedelta(days=NEW_CONCEPT_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    return RunCtx(now, now.strftime('%Y-%m-%d'), cutoff, time.monotonic())
+
+def run_task():
+    ctx = new_run_ctx()
+    today_str = ctx.today_str
+    print(f"🚀 启动: {today_str}")
+    prune_cache()
+    CACHE_STATS.clear()
+    use_shared_session()
+
+    top_concepts = []
+    try:
+        df = get_concept_boards(today_str)
+        if df is not None:
+            # 先过滤再取前10：nlargest 只做部分选择，不用整表排序
+            df = df[~df['板块名称'].str.contains(_CONCEPT_EXCLUDE_RE)]
+            top_concepts = list(df.nlargest(10, '涨跌幅')[['板块名称', '涨跌幅']].itertuples(index=False, name=None))
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"⚠️ 板块数据异常: {e}")
+
+    history_data = load_history(ctx.now)
+    
+    past_set = set().union(*(names for d, names in history_data.items() if ctx.cutoff < d < today_str))
+    
+    new_concepts = [n for n, r in top_concepts if n not in past_set]
+
+    picks = run_strict_selection(ctx, top_concepts, new_concepts)
+
+    history_files = list_recent_archives()
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    html = generate_html_report(ctx, new_concepts, top_concepts, picks, history_files)
+    archive_path = f"{ARCHIVE_DIR}/{today_str}.html"
+    atomic_write(archive_path, html.encode('utf-8'))
+    # 首页与当日归档内容相同，硬链接过去即可，不必再写一遍；链到临时名再替换，首页不会有缺失的瞬间
+    index_tmp = f"{HTML_FILE}.tmp"
+    if os.path.exists(index_tmp): os.remove(index_tmp)
+    try: os.link(archive_path, index_tmp)
+    except OSError: shutil.copyfile(archive_path, index_tmp)
+    os.replace(index_tmp, HTML_FILE)
+
+    # 发送 Telegram (没配置就连消息也不拼)
+    if TG_BOT_TOKEN and TG_CHAT_IDS: send_telegram_message(build_telegram_message(ctx, new_concepts, picks))
+    else: print("❌ 未检测到 TG 配置")
+
+    # 当天已记录且板块没变 (比如重跑) 就不用再写盘
+    today_names = [x[0] for x in top_concepts]
+    if today_names and history_data.get(today_str) != today_names:
+        history_data[today_str] = today_names
+        save_history(history_data)
 
-    if top_concepts:
-        history_data[today_str] = [x[0] for x in top_concepts]
-        with open(HISTORY_FILE, 'w') as f: json.dump(history_data, f)
+    for name in sorted({n for n, _ in CACHE_STATS}):
+        print(f"💾 缓存 {name}: 命中 {CACHE_STATS[(name, 'hit')]} / 未命中 {CACHE_STATS[(name, 'miss')]}")
+    print(f"⏱ 总耗时 {time.monotonic() - ctx.started_at:.1f}s")
 
 if __name__ == "__main__":
     run_task()